@@ -23,24 +23,26 @@ Example configuration (in YAML syntax)::
 """
 
 import argparse
+import ctypes
+import json
 import logging
+import queue
 import sys
+import threading
 import time
 
-from os.path import exists
+from os import remove
+from os.path import exists, getmtime
 
 import sendKey
 
+import yaml
+
 try:
-    from functools import lru_cache
+    from yaml import CSafeLoader as YamlLoader
 except ImportError:
-    # Python < 3.2
-    try:
-        from backports.functools_lru_cache import lru_cache
-    except ImportError:
-        lru_cache = lambda: lambda func: func
-
-import yaml
+    # LibYAML bindings not available
+    from yaml import SafeLoader as YamlLoader
 
 import rtmidi
 from rtmidi.midiutil import open_midiinput
@@ -63,6 +65,11 @@ STATUS_MAP = {
     'polypressure': POLY_PRESSURE,
     'channelpressure': CHANNEL_PRESSURE
 }
+# (status, channel) for every possible status byte
+STATUS_TABLE = tuple(((b & 0xF0, (b & 0xF) + 1) if b < 0xF0 else (b, None))
+                     for b in range(256))
+# relative encoder values: 63 for any decrement, 65 for any increment
+CC_BUCKET = bytes([63] * 64 + [64] + [65] * 63)
 
 KEY_UP = 1
 KEY_DOWN = 2
@@ -71,12 +78,24 @@ KEY_DOWN_UP = KEY_UP | KEY_DOWN
 
 class KeyStroke(object):
     def __init__(self, name='', description='', status=0xB0, channel=None, data=None,
-                 keys=None):
+                 keys=None, delay=0):
         self.name = name
         self.description = description
         self.status = status
         self.channel = channel
-        self.keys = keys.split()
+
+        if keys is None:
+            self.keys = []
+        elif hasattr(keys, 'split'):
+            self.keys = keys.split()
+        else:
+            self.keys = list(keys)
+
+        self.keycodes = [sendKey.SetKeyboardConsts(key) for key in self.keys]
+        # milliseconds between press and release of controller change keystrokes
+        self.delay = float(delay) / 1000
+        if self.delay < 0:
+            raise ValueError("'delay' must not be negative.")
 
         if data is None or isinstance(data, int):
             self.data = data
@@ -89,83 +108,111 @@ class KeyStroke(object):
 class MidiInputHandler(object):
     def __init__(self, port, config):
         self.port = port
-        self._wallclock = time.time()
-        self.keystrokes = dict()
+        self._wallclock = time.monotonic()
+        self._index = dict()
         self.load_config(config)
+        self.reload_log_level()
+        self._queue = queue.SimpleQueue()
+        self._worker = threading.Thread(target=self._run, name='midi2keystroke',
+                                        daemon=True)
+        self._worker.start()
 
     def __call__(self, event, data=None):
-        event, deltatime = event
-        self._wallclock += deltatime
+        # Runs on the rtmidi thread: only hand the message over to the worker.
+        if event[0][0] >= 0xF8:
+            # system real-time (clock, active sensing, ...) never maps to a keystroke
+            return
+        self._queue.put_nowait((event, time.monotonic()))
 
-        if event[0] < 0xF0:
-            channel = (event[0] & 0xF) + 1
-            status = event[0] & 0xF0
-        else:
-            status = event[0]
-            channel = None
+    def reload_log_level(self):
+        """Re-read whether debug logging is enabled.
 
-        data1 = data2 = None
-        num_bytes = len(event)
+        The level is cached for the MIDI event path; call this after changing
+        the logging level at runtime.
 
-        if num_bytes >= 2:
-            data1 = event[1]
-        if num_bytes >= 3:
-            data2 = event[2]
+        """
+        self._debug = log.isEnabledFor(logging.DEBUG)
 
-        log.debug("[%s] @%i CH:%2s s:%02X d1:%s d2:%s", self.port, self._wallclock,
-                  channel or '-', status, data1, data2 or '')
+    def close(self):
+        """Stop the worker thread after it has handled all queued messages."""
+        self._queue.put_nowait(None)
+        self._worker.join()
+
+    def _run(self):
+        get = self._queue.get
+        handle_event = self.handle_event
+        while True:
+            item = get()
+            if item is None:
+                break
+
+            try:
+                handle_event(*item)
+            except:  # noqa: E722
+                log.exception("Error handling MIDI message.")
+
+    def handle_event(self, event, received, _STATUS_TABLE=STATUS_TABLE,
+                     _NOTE_OFF=NOTE_OFF, _CONTROLLER_CHANGE=CONTROLLER_CHANGE):
+        debug = self._debug
+        event, deltatime = event
+        if len(event) == 3:
+            status_byte, data1, data2 = event
+        else:
+            status_byte, data1, data2 = (list(event) + [None, None])[:3]
+
+        status, channel = _STATUS_TABLE[status_byte]
+
+        if debug:
+            self._wallclock += deltatime
+            log.debug("[%s] @%i CH:%2s s:%02X d1:%s d2:%s (queued %.3f ms)", self.port,
+                      self._wallclock, channel or '-', status, data1, data2 or '',
+                      (time.monotonic() - received) * 1000)
 
         # Look for matching command definitions
         cmd = self.lookup_command(status, channel, data1, data2)
 
         if cmd:
             action_type = KEY_DOWN
-            if status == NOTE_OFF:
+            if status == _NOTE_OFF:
                 action_type = KEY_UP
-            if status == CONTROLLER_CHANGE:
+            if status == _CONTROLLER_CHANGE:
                 action_type = KEY_DOWN_UP
 
-            self.do_command(cmd.keys, action_type)
-        else:
+            self.do_command(cmd, action_type)
+        elif debug:
             log.debug("no cmd")
 
-    @lru_cache
     def lookup_command(self, status, channel, data1, data2):
-        if status == NOTE_OFF:
-            status = NOTE_ON
-        elif status == CONTROLLER_CHANGE and data2 < 64:
-            data2 = 63
-        elif status == CONTROLLER_CHANGE and data2 > 64:
-            data2 = 65
-
-        for keystroke in self.keystrokes.get(status, []):
-            if channel is not None and keystroke.channel != channel:
-                continue
-
-            if status == NOTE_ON and keystroke.data == data1:
-                return keystroke
-            elif (isinstance(keystroke.data, list) and
-                  keystroke.data[0] == data1 and keystroke.data[1] == data2):
-                return keystroke
-
-    @staticmethod
-    def do_command(keystrokes, action_type):
+        if status == NOTE_OFF or status == NOTE_ON:
+            # entries with a velocity take precedence over note-only entries
+            return (self._index.get((NOTE_ON, channel, data1, data2)) or
+                    self._index.get((NOTE_ON, channel, data1, None)))
+        elif status == CONTROLLER_CHANGE:
+            data2 = CC_BUCKET[data2]
+
+        return self._index.get((status, channel, data1, data2))
+
+    def do_command(self, cmd, action_type):
+        debug = self._debug
+        press = sendKey.PressKeys
+        release = sendKey.ReleaseKeys
         try:
             if action_type == KEY_DOWN or action_type == KEY_DOWN_UP:
-                for keystroke in keystrokes:
-                    log.info("press: %s", keystroke)
-                    keycode = sendKey.SetKeyboardConsts(keystroke)
-                    sendKey.PressKey(keycode)
-
-            if action_type == KEY_DOWN_UP:
-                log.info("delay")
-                time.sleep(0.01)
-
-            if action_type == KEY_UP or action_type == KEY_DOWN_UP:
-                for keystroke in keystrokes:
-                    log.info("release: %s", keystroke)
-                    keycode = sendKey.SetKeyboardConsts(keystroke)
-                    sendKey.ReleaseKey(keycode)
+                if debug:
+                    log.debug("press: %s", cmd.keys)
+                press(cmd.keycodes)
+
+            # once pressed, always release, so no key is left held down
+            try:
+                if action_type == KEY_DOWN_UP and cmd.delay:
+                    if debug:
+                        log.debug("delay")
+                    time.sleep(cmd.delay)
+            finally:
+                if action_type == KEY_UP or action_type == KEY_DOWN_UP:
+                    if debug:
+                        log.debug("release: %s", cmd.keys)
+                    release(cmd.keycodes)
         except:  # noqa: E722
             log.exception("Error calling external command.")
 
@@ -173,30 +220,84 @@ class MidiInputHandler(object):
         if not exists(filename):
             raise IOError("Config file not found: %s" % filename)
 
-        with open(filename) as patch:
-            data = yaml.load(patch, Loader=yaml.FullLoader)
+        data = self.load_yaml(filename)
 
         for cmdspec in data:
             try:
-                if isinstance(cmdspec, dict) and 'keys' in cmdspec:
+                if isinstance(cmdspec, dict):
                     cmd = KeyStroke(**cmdspec)
                 elif len(cmdspec) >= 2:
                     cmd = KeyStroke(*cmdspec)
+                else:
+                    raise ValueError("expected a mapping or a list of fields")
+            except KeyError as exc:
+                raise IOError("Unknown key in command specification: %s" % exc)
             except (TypeError, ValueError) as exc:
                 log.debug(cmdspec)
                 raise IOError("Invalid command specification: %s" % exc)
             else:
-                status = STATUS_MAP.get(cmd.status.strip().lower())
+                status = STATUS_MAP.get(str(cmd.status).strip().lower())
 
                 if status is None:
                     try:
-                        int(cmd.status)
+                        status = int(cmd.status)
                     except:  # noqa: E722
                         log.error("Unknown status '%s'. Ignoring command",
                                   cmd.status)
+                        continue
 
                 log.debug("Config: %s\n%s\n%s\n", cmd.name, cmd.description, cmd.keys)
-                self.keystrokes.setdefault(status, []).append(cmd)
+
+                if status == NOTE_ON and isinstance(cmd.data, int):
+                    key = (status, cmd.channel, cmd.data, None)
+                elif isinstance(cmd.data, list):
+                    if len(cmd.data) != 2:
+                        raise IOError("Invalid command specification: %s: 'data' needs "
+                                      "two values, got %r" % (cmd.name, cmd.data))
+                    key = (status, cmd.channel, cmd.data[0], cmd.data[1])
+                else:
+                    continue
+
+                # first matching definition wins, as with the former linear scan
+                self._index.setdefault(key, cmd)
+
+        sendKey.ReserveInputs(max((len(cmd.keycodes) for cmd in self._index.values()),
+                                  default=0))
+
+    @staticmethod
+    def load_yaml(filename):
+        """Return the parsed YAML config, using a cached JSON copy when up to date.
+
+        The parsed data is cached in ``<filename>.cache``, whose first line
+        holds the modification time of the YAML file it was created from.
+        An unreadable cache is ignored and rewritten.
+
+        """
+        cache_path = filename + '.cache'
+        mtime = repr(getmtime(filename))
+
+        try:
+            with open(cache_path) as cache:
+                if cache.readline().rstrip('\n') == mtime:
+                    return json.load(cache)
+        except Exception as exc:
+            log.debug("Ignoring config cache: %s", exc)
+
+        with open(filename) as patch:
+            data = yaml.load(patch, Loader=YamlLoader)
+
+        try:
+            payload = json.dumps(data)
+            with open(cache_path, 'w') as cache:
+                cache.write(mtime + '\n' + payload)
+        except (IOError, TypeError, ValueError) as exc:
+            log.debug("Could not write config cache: %s", exc)
+            try:
+                remove(cache_path)
+            except OSError:
+                pass
+
+        return data
 
 
 def main(args=None):
@@ -236,17 +337,26 @@ def main(args=None):
         return
 
     log.debug("Attaching MIDI input callback handler.")
-    midiin.set_callback(MidiInputHandler(port_name, args.config))
+    handler = MidiInputHandler(port_name, args.config)
+    midiin.set_callback(handler)
+
+    # 1 ms timer resolution, so per-entry press/release delays are not rounded
+    # up to the default ~15 ms scheduler tick
+    winmm = ctypes.windll.winmm
+    winmm.timeBeginPeriod(1)
 
     log.info("Entering main loop. Press Control-C to exit.")
     try:
-        # just wait for keyboard interrupt in main thread
+        # just wait for keyboard interrupt in main thread (a blocking
+        # threading.Event().wait() can't be interrupted by Control-C on Windows)
         while True:
             time.sleep(1)
     except KeyboardInterrupt:
         print('')
     finally:
         midiin.close_port()
+        handler.close()
+        winmm.timeEndPeriod(1)
         del midiin
 
 
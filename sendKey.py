@@ -52,6 +52,10 @@ class Input(ctypes.Structure):
                 ("ii", Input_I)]
 
 
+SendInput.argtypes = [ctypes.c_uint, ctypes.POINTER(Input), ctypes.c_int]
+SendInput.restype = ctypes.c_uint
+
+
 # Actuals Functions
 
 #######################################################################
@@ -60,27 +64,69 @@ class Input(ctypes.Structure):
 # Taken from http://www.ionicwind.com/guides/emergence/appendix_a.htm
 #
 #######################################################################
+with open('keybindings.json') as data_file:
+    _KEYBINDS = {name: int(code, 16)
+                 for name, code in json.load(data_file)["keybindings"].items()}
+
+
 def SetKeyboardConsts(panel_key):
-    with open('keybindings.json') as data_file:
-        key_binds = json.load(data_file)
-        # print(key_binds["keybindings"][panel_key])
-        return int(key_binds["keybindings"][panel_key], 16)
+    return _KEYBINDS[panel_key]
+
+
+# A single INPUT record reused for every key event; only the scan code and
+# flags change between calls.
+_extra = ctypes.c_ulong(0)
+_ii = Input_I()
+_ii.ki = KeyBdInput(0, 0, 0, 0, ctypes.pointer(_extra))
+_INPUT = Input(1, _ii)
+_P_INPUT = ctypes.byref(_INPUT)
+_SZ_INPUT = ctypes.sizeof(_INPUT)
+_ki = _INPUT.ii.ki
 
 
 def PressKey(hexKeyCode):
-    extra = ctypes.c_ulong(0)
-    ii_ = Input_I()
-    ii_.ki = KeyBdInput(0, hexKeyCode, 0x0008, 0, ctypes.pointer(extra))
-    x = Input(ctypes.c_ulong(1), ii_)
-    ctypes.windll.user32.SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
+    _ki.wScan = hexKeyCode
+    _ki.dwFlags = 0x0008
+    SendInput(1, _P_INPUT, _SZ_INPUT)
 
 
 def ReleaseKey(hexKeyCode):
-    extra = ctypes.c_ulong(0)
-    ii_ = Input_I()
-    ii_.ki = KeyBdInput(0, hexKeyCode, 0x0008 | 0x0002, 0, ctypes.pointer(extra))
-    x = Input(ctypes.c_ulong(1), ii_)
-    ctypes.windll.user32.SendInput(1, ctypes.pointer(x), ctypes.sizeof(x))
+    _ki.wScan = hexKeyCode
+    _ki.dwFlags = 0x0008 | 0x0002
+    SendInput(1, _P_INPUT, _SZ_INPUT)
+
+
+# INPUT array reused by SendInputs, sized to the longest key chord.
+_batch = (Input * 0)()
+
+
+def ReserveInputs(count):
+    global _batch
+    if count > len(_batch):
+        _batch = (Input * count)()
+        for entry in _batch:
+            entry.type = 1
+            entry.ii.ki.dwExtraInfo = ctypes.pointer(_extra)
+
+
+def SendInputs(hexKeyCodes, flags):
+    count = len(hexKeyCodes)
+    if count > len(_batch):
+        ReserveInputs(count)
+    batch = _batch
+    for i, hexKeyCode in enumerate(hexKeyCodes):
+        ki = batch[i].ii.ki
+        ki.wScan = hexKeyCode
+        ki.dwFlags = flags
+    SendInput(count, batch, _SZ_INPUT)
+
+
+def PressKeys(hexKeyCodes):
+    SendInputs(hexKeyCodes, 0x0008)
+
+
+def ReleaseKeys(hexKeyCodes):
+    SendInputs(hexKeyCodes, 0x0008 | 0x0002)
 
 
 def KeyStroke(hexKeyCode):